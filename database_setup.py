@@ -20,6 +20,14 @@ def setup_database():
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
 
+        # WAL journaling is persistent in the database file, so every later
+        # connection (including insert_id_card_tool) writes without an fsync per
+        # commit. The remaining PRAGMAs apply to this connection only.
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+
         # Check if the table already exists to prevent errors on re-running
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='id_cards'")
         if cursor.fetchone():
@@ -1,17 +1,24 @@
 import os
+import asyncio
 import logging
 import json
+import hashlib
+from contextlib import asynccontextmanager
 from uuid import uuid4
-from typing import TypedDict, Annotated, List, Dict, Any
+from typing import TypedDict, Annotated, AsyncIterator, List, Dict, Any
 
-from flask import Flask, request, render_template, jsonify
+from quart import Quart, request, render_template, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import FileTarget
 
 from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
 # --- Import Agent Tools ---
 from tools.analyze_id_card import analyze_id_card_tool
@@ -19,14 +26,24 @@ from tools.database_tools import check_duplicate_nik_tool, insert_id_card_tool
 from tools.notify_fraud import notify_fraud_tool
 import ast
 
+# orjson is an optional, faster drop-in for parsing tool arguments
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 # --- Load Environment Variables & Configure App ---
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+app = Quart(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+CHECKPOINT_DB = "agent_state.db"
+# Analysis outcomes that depend only on the image, and so can be reused when the
+# same image is uploaded again. Errors are always retried.
+REUSABLE_ANALYSIS_STATUSES = {'success', 'potential_fraud', 'image_quality_failure'}
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # --- Agent State Definition ---
@@ -35,9 +52,11 @@ class AgentState(TypedDict):
     analysis_result: Dict[str, Any] | None
 
 # --- LLM & Tool Initialization ---
+tools = [analyze_id_card_tool, check_duplicate_nik_tool, insert_id_card_tool, notify_fraud_tool]
+TOOL_BY_NAME = {t.name: t for t in tools}
+
 try:
     llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", convert_system_message_to_human=True)
-    tools = [analyze_id_card_tool, check_duplicate_nik_tool, insert_id_card_tool, notify_fraud_tool]
     llm_with_tools = llm.bind_tools(tools)
 except Exception as e:
     logger.critical(f"Could not initialize Google Generative AI. Check API Key. Error: {e}")
@@ -45,58 +64,83 @@ except Exception as e:
 
 # --- Agent Workflow Definition ---
 
+def parse_data_argument(raw: str) -> Dict[str, Any]:
+    """
+    Parses a stringified 'data' tool argument back into a dictionary.
+    The LLM almost always emits JSON, so that is tried first; Python literal
+    syntax (single quotes, True/None) is handled as a fallback.
+    """
+    try:
+        return json_loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
 # 1. Agent Node: The primary thinking loop of the agent
-def agent_node(state: AgentState):
+async def agent_node(state: AgentState):
     logger.info("Agent node executing...")
-    response = llm_with_tools.invoke(state['messages'])
+    response = await llm_with_tools.ainvoke(state['messages'])
     return {"messages": [response]}
 
 # 2. Tool Node: Executes the tools called by the agent
-def tool_node(state: AgentState) -> dict:
+async def run_tool_call(call: Dict[str, Any], cached_analysis: Dict[str, Any] | None = None) -> Any:
+    """Validates and invokes a single tool call, returning the tool output or an error string."""
+    tool_name = call['name']
+    tool_args = call.get('args', {})
+
+    # The image was already analyzed on an earlier upload; skip the Gemini call
+    if tool_name == 'analyze_id_card_tool' and cached_analysis:
+        logger.info("Reusing the checkpointed analysis result for this image.")
+        return cached_analysis
+
+    # --- FINAL FIX STARTS HERE ---
+    # Before invoking the tool, we check if the 'data' argument needs to be parsed from a string.
+    if tool_name == 'insert_id_card_tool' and isinstance(tool_args.get('data'), str):
+        try:
+            logger.info("Found 'data' argument as a string. Parsing back to dictionary.")
+            tool_args['data'] = parse_data_argument(tool_args['data'])
+        except (ValueError, SyntaxError) as e:
+            # If parsing fails, return an error message to the agent.
+            logger.error(f"Fatal: Failed to parse 'data' argument string: {e}")
+            return "Error: The 'data' argument was a malformed string and could not be parsed."
+    # --- FINAL FIX ENDS HERE ---
+
+    logger.info(f"Invoking tool: {tool_name} with args: {tool_args}")
+
+    selected_tool = TOOL_BY_NAME.get(tool_name)
+    if not selected_tool:
+        raise ValueError(f"Tool '{tool_name}' not found.")
+
+    return await selected_tool.ainvoke(tool_args)
+
+async def tool_node(state: AgentState) -> dict:
     logger.info("Tool node executing...")
     tool_calls = state["messages"][-1].tool_calls
+
+    analysis_result = state.get('analysis_result')
+    cached_analysis = None
+    if analysis_result and analysis_result.get('status') in REUSABLE_ANALYSIS_STATUSES:
+        cached_analysis = analysis_result
+
+    # Independent tool calls from the same step run concurrently; gather keeps them in order
+    outputs = await asyncio.gather(*(run_tool_call(call, cached_analysis) for call in tool_calls))
+
+    update = {}
     tool_outputs = []
-    
-    for call in tool_calls:
-        tool_name = call['name']
-        tool_args = call.get('args', {})
-
-        # --- FINAL FIX STARTS HERE ---
-        # Before invoking the tool, we check if the 'data' argument needs to be parsed from a string.
-        if tool_name == 'insert_id_card_tool' and isinstance(tool_args.get('data'), str):
-            try:
-                # ast.literal_eval safely parses a string representation of a Python literal.
-                logger.info("Found 'data' argument as a string. Parsing back to dictionary.")
-                tool_args['data'] = ast.literal_eval(tool_args['data'])
-            except (ValueError, SyntaxError) as e:
-                # If parsing fails, return an error message to the agent.
-                logger.error(f"Fatal: Failed to parse 'data' argument string: {e}")
-                tool_outputs.append(
-                    ToolMessage(content=f"Error: The 'data' argument was a malformed string and could not be parsed.", tool_call_id=call['id'])
-                )
-                continue # Move to the next tool call
-        # --- FINAL FIX ENDS HERE ---
-
-        logger.info(f"Invoking tool: {tool_name} with args: {tool_args}")
-        
-        selected_tool = next((t for t in tools if t.name == tool_name), None)
-        if not selected_tool:
-            raise ValueError(f"Tool '{tool_name}' not found.")
-            
-        output = selected_tool.invoke(tool_args)
-        
+    for call, output in zip(tool_calls, outputs):
         # If this was the analysis tool, store its result in the state for the router
-        if tool_name == 'analyze_id_card_tool':
-            state['analysis_result'] = output
-        
+        if call['name'] == 'analyze_id_card_tool':
+            update['analysis_result'] = output
+
         tool_outputs.append(ToolMessage(content=str(output), tool_call_id=call['id']))
-        
-    return {"messages": tool_outputs}
+
+    update['messages'] = tool_outputs
+    return update
 
 # 3. Router: Decides the next step based on the analysis result
 def router(state: AgentState) -> str:
     logger.info("Router node executing...")
-    analysis_status = state.get('analysis_result', {}).get('status')
+    analysis_result = state.get('analysis_result')
+    analysis_status = analysis_result.get('status') if analysis_result else None
     logger.info(f"Analysis status for routing: {analysis_status}")
 
     if analysis_status == 'success':
@@ -136,28 +180,105 @@ graph_builder.add_conditional_edges(
 # to process the tool's output.
 graph_builder.add_edge("tools", "agent")
 
-# Compile the graph
-graph = graph_builder.compile()
+# The graph is compiled with its checkpointer once the server's event loop is running
+graph = None
+checkpointer = None
 
-# --- Flask Routes ---
+@app.while_serving
+async def open_checkpointer():
+    global graph, checkpointer
+    async with AsyncSqliteSaver.from_conn_string(CHECKPOINT_DB) as saver:
+        checkpointer = saver
+        graph = graph_builder.compile(checkpointer=saver)
+        yield
+        graph = None
+        checkpointer = None
+
+# One run per image at a time: concurrent uploads of the same file share a thread_id,
+# and add_messages would otherwise merge their transcripts into one checkpoint.
+# Entries are [lock, number of holders and waiters].
+_thread_locks: Dict[str, list] = {}
+
+@asynccontextmanager
+async def claim_thread(thread_id: str) -> AsyncIterator[None]:
+    entry = _thread_locks.setdefault(thread_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _thread_locks[thread_id]
+
+# --- Web Routes ---
 @app.route('/', methods=['GET'])
-def index():
+async def index():
     """Renders the main upload page."""
-    return render_template('index.html')
+    return await render_template('index.html')
+
+class HashingFileTarget(FileTarget):
+    """FileTarget that also computes the SHA-256 of the bytes it writes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sha256 = hashlib.sha256()
+
+    def on_data_received(self, chunk: bytes):
+        self._sha256.update(chunk)
+        super().on_data_received(chunk)
+
+    @property
+    def hexdigest(self) -> str:
+        return self._sha256.hexdigest()
+
+async def save_upload_stream(body, headers, path: str) -> HashingFileTarget:
+    """Feeds a multipart request body to disk chunk by chunk, returning the file target."""
+    target = HashingFileTarget(path)
+    parser = StreamingFormDataParser(headers=headers)
+    parser.register('file', target)
+    async for chunk in body:
+        # Parsing and the disk write run in a worker thread to keep the event loop free
+        await asyncio.to_thread(parser.data_received, chunk)
+    return target
 
 @app.route('/upload', methods=['POST'])
-def upload_file():
+async def upload_file():
     """Handles file upload and triggers the fraud detection agent."""
-    if 'file' not in request.files or not llm_with_tools:
+    if not llm_with_tools:
         return jsonify({"error": "Invalid request or LLM not initialized"}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
+    if request.content_length and request.content_length > app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({"error": "File too large"}), 413
+
+    # Stream the multipart body straight to disk instead of letting the framework
+    # parse and buffer it first. Files are stored under their content hash, which
+    # is only known once the body has been read, so write to a temporary path first.
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid4()}.part")
+    try:
+        target = await save_upload_stream(request.body, request.headers, tmp_path)
+    except RequestEntityTooLarge:
+        # Bodies without a Content-Length are only caught while streaming
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return jsonify({"error": "File too large"}), 413
+    except Exception as e:
+        logger.error(f"Failed to parse upload: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return jsonify({"error": "Malformed upload; expected a multipart form with a 'file' field"}), 400
+
+    if not target.multipart_filename:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return jsonify({"error": "No selected file"}), 400
 
-    filename = secure_filename(file.filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid4()}_{filename}")
-    file.save(filepath)
+    ext = os.path.splitext(secure_filename(target.multipart_filename))[1].lower()
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{target.hexdigest}{ext}")
+    if os.path.exists(filepath):
+        # Identical content was uploaded before; keep the stored copy
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, filepath)
 
     # This is the initial prompt that starts the entire process
     system_prompt = """
@@ -177,18 +298,35 @@ def upload_file():
     """
     initial_message = HumanMessage(content=f"{system_prompt}\n\nFile Path: {filepath}")
     
+    # State is checkpointed under the image's content hash. Only the Gemini analysis
+    # is reused on a re-upload: the previous run is deleted before a fresh one starts,
+    # so the duplicate check and fraud notification still happen, a run that failed
+    # part-way is never resumed into the same failure, and the checkpoint store keeps
+    # at most one run (and one copy of the card's personal data) per image.
+    config = {
+        "configurable": {"thread_id": target.hexdigest},
+        # Limit the number of steps to prevent infinite loops
+        "recursion_limit": 15,
+    }
+
     final_response = "Agent did not produce a final response."
     try:
-        events = graph.stream(
-            {"messages": [initial_message]},
-            # Limit the number of steps to prevent infinite loops
-            {"recursion_limit": 15}
-        )
-        for event in events:
-            if "agent" in event:
-                message = event["agent"]["messages"][-1]
-                if not message.tool_calls and message.content:
-                    final_response = message.content
+        async with claim_thread(target.hexdigest):
+            snapshot = await graph.aget_state(config)
+            cached_analysis = snapshot.values.get("analysis_result")
+            if not cached_analysis or cached_analysis.get("status") not in REUSABLE_ANALYSIS_STATUSES:
+                cached_analysis = None
+            await checkpointer.adelete_thread(target.hexdigest)
+
+            graph_input = {"messages": [initial_message], "analysis_result": cached_analysis}
+
+            # Run the graph asynchronously; under ASGI the event loop keeps serving
+            # other requests while this one waits on the model
+            async for event in graph.astream(graph_input, config):
+                if "agent" in event:
+                    message = event["agent"]["messages"][-1]
+                    if not message.tool_calls and message.content:
+                        final_response = message.content
     except Exception as e:
         logger.error(f"Error during graph execution: {e}")
         final_response = f"An error occurred: {e}"
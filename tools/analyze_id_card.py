@@ -3,6 +3,7 @@ import base64
 import logging
 import json
 import io
+import re
 from typing import Dict, Any
 
 from langchain_core.tools import tool
@@ -11,53 +12,39 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from PIL import Image
 
+# orjson is an optional, faster drop-in for parsing the model response
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# --- Pydantic Schema for Tool Input ---
-class AnalyzeIdCardInput(BaseModel):
-    """Input schema for the ID card analysis tool."""
-    image_path: str = Field(description="The file path to the ID card image to be analyzed.")
-
-@tool("analyze_id_card_tool", args_schema=AnalyzeIdCardInput)
-def analyze_id_card_tool(image_path: str) -> Dict[str, Any]:
-    """
-    Analyzes an ID card image using a detailed set of rules for quality, data extraction,
-    and positional checks. It returns a dictionary with the analysis outcome.
-    """
-    if not os.path.exists(image_path):
-        logger.error(f"File not found at path: {image_path}")
-        return {"status": "error", "error": f"File not found at path: {image_path}"}
-    
-    print('calling tool')
-
-    # --- Initialize the Gemini Vision Model ---
-    try:
-        # Using a powerful vision-capable model as requested.
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-preview-05-20",
-            thinking_budget=2000,
-            temperature=0.2,
-            include_thoughts=True,
-            verbose=True,
-        )
-    except Exception as e:
-        logger.error(f"Failed to initialize the language model: {e}")
-        return {"status": "error", "error": "Could not initialize Gemini model. Check API key."}
-
-    # --- Prepare the Image ---
-    try:
-        with Image.open(image_path) as img:
-            byte_arr = io.BytesIO()
-            img.convert("RGB").save(byte_arr, format='PNG')
-            image_b64 = base64.b64encode(byte_arr.getvalue()).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Failed to process the image: {e}")
-        return {"status": "error", "error": f"Invalid or corrupted image file: {image_path}"}
-
-    # --- Construct the Detailed Prompt ---
-    prompt = """
+# --- Image Encoding Settings ---
+# Images are downscaled and sent as JPEG; a quality-85 JPEG keeps the card text
+# readable while being several times smaller than a lossless PNG.
+MAX_IMAGE_SIZE = (1600, 1600)
+JPEG_QUALITY = 85
+# Files already in a supported format and under this size are sent as-is
+PASSTHROUGH_MAX_BYTES = 2_000_000
+# The format is identified from the file's magic bytes, not its (client-supplied) extension
+PASSTHROUGH_SIGNATURES = ((b'\xff\xd8\xff', 'image/jpeg'), (b'\x89PNG\r\n\x1a\n', 'image/png'))
+
+def _sniff_mime_type(data: bytes) -> str | None:
+    """Returns the mime type if the data starts with a JPEG or PNG signature."""
+    for signature, mime_type in PASSTHROUGH_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    return None
+
+# Matches the outermost JSON object in the model response, ignoring any
+# markdown fences or commentary around it
+_JSON_RE = re.compile(r"\{.*\}", re.S)
+
+# --- Detailed Analysis Prompt ---
+_PROMPT_TEXT = """
     You are an ID card verification system. Your primary goal is to accurately assess ID card images based on a set of predefined rules.
     You must return a single JSON object with a "status" field and other relevant fields based on the outcome.
 
@@ -104,11 +91,81 @@ def analyze_id_card_tool(image_path: str) -> Dict[str, Any]:
     * **If data/positional checks fail:** Return `{"status": "potential_fraud", "reason": "Specific field or positional check that failed."}`.
     * **If image quality fails:** Return `{"status": "image_quality_failure", "reason": "Specific quality issue like 'Blur' or 'Glare'."}`.
     """
+# Shared text part of every analysis message; only the image part differs per call
+_PROMPT_TEXT_PART = {"type": "text", "text": _PROMPT_TEXT}
+
+# --- Gemini Vision Model ---
+# Built lazily on first use and reused across calls, so credential discovery and
+# HTTP transport setup happen only once per process.
+_llm = None
+
+def _get_llm() -> ChatGoogleGenerativeAI:
+    global _llm
+    if _llm is None:
+        # Thinking adds latency and output tokens and 2.5 Flash thinks unless the
+        # budget is 0, so it is only enabled for debugging
+        kwargs = {"thinking_budget": 0}
+        if os.getenv("DEBUG_THINKING"):
+            kwargs.update(thinking_budget=2000, include_thoughts=True, verbose=True)
+        # Using a powerful vision-capable model as requested.
+        _llm = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash-preview-05-20",
+            temperature=0.2,
+            **kwargs,
+        )
+    return _llm
+
+# --- Pydantic Schema for Tool Input ---
+class AnalyzeIdCardInput(BaseModel):
+    """Input schema for the ID card analysis tool."""
+    image_path: str = Field(description="The file path to the ID card image to be analyzed.")
+
+@tool("analyze_id_card_tool", args_schema=AnalyzeIdCardInput)
+def analyze_id_card_tool(image_path: str) -> Dict[str, Any]:
+    """
+    Analyzes an ID card image using a detailed set of rules for quality, data extraction,
+    and positional checks. It returns a dictionary with the analysis outcome.
+    """
+    print('calling tool')
+
+    # --- Initialize the Gemini Vision Model ---
+    try:
+        llm = _get_llm()
+    except Exception as e:
+        logger.error(f"Failed to initialize the language model: {e}")
+        return {"status": "error", "error": "Could not initialize Gemini model. Check API key."}
+
+    # --- Prepare the Image ---
+    try:
+        mime_type = None
+        if os.path.getsize(image_path) < PASSTHROUGH_MAX_BYTES:
+            # Small JPEG/PNG files can be sent directly, skipping a decode + re-encode
+            with open(image_path, 'rb') as f:
+                raw = f.read()
+            mime_type = _sniff_mime_type(raw)
+            if mime_type:
+                image_b64 = base64.b64encode(raw).decode('utf-8')
+
+        if mime_type is None:
+            with Image.open(image_path) as img:
+                img.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
+                byte_arr = io.BytesIO()
+                img.convert("RGB").save(byte_arr, format='JPEG', quality=JPEG_QUALITY, optimize=True)
+                image_b64 = base64.b64encode(byte_arr.getvalue()).decode('utf-8')
+            mime_type = 'image/jpeg'
+    except FileNotFoundError:
+        # No separate existence check up front; the first stat/open reports it
+        logger.error(f"File not found at path: {image_path}")
+        return {"status": "error", "error": f"File not found at path: {image_path}"}
+    except Exception as e:
+        logger.error(f"Failed to process the image: {e}")
+        return {"status": "error", "error": f"Invalid or corrupted image file: {image_path}"}
 
+    # --- Construct the Message ---
     message = HumanMessage(
         content=[
-            {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}},
+            _PROMPT_TEXT_PART,
+            {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}"}},
         ]
     )
 
@@ -117,14 +174,12 @@ def analyze_id_card_tool(image_path: str) -> Dict[str, Any]:
         logger.info(f"Sending image '{image_path}' to Gemini for detailed analysis...")
         response = llm.invoke([message])
         logger.info(response)
-        response_content = response.content.strip()
-
-        # Clean the response to ensure it is valid JSON
-        if response_content.startswith("```json"):
-            response_content = response_content[7:-4].strip()
+        # .text joins the text parts; .content is a list when thoughts are included
+        response_content = response.text
 
-        # Parse the JSON string into a Python dictionary
-        result = json.loads(response_content)
+        # Extract the JSON object from the response and parse it into a dictionary
+        match = _JSON_RE.search(response_content)
+        result = json_loads(match.group(0) if match else response_content)
         logger.info(f"Successfully received and parsed analysis from model: {result}")
         return result
 
@@ -1,17 +1,67 @@
 import sqlite3
 import logging
-from typing import Dict, Any
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List
 
 from pydantic import BaseModel, Field
 from langchain_core.tools import tool
 
 # --- Configuration ---
 DB_FILE = "identity_database.db"
+POOL_SIZE = 4
+NIK_CACHE_MAXSIZE = 4096
 
 # --- Configure Logging ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- Connection Pool ---
+# Connections are opened once at import and shared by the tools, instead of
+# re-opening the database file (and its -wal/-shm companions) on every call.
+def _open_connection() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")
+    return conn
+
+_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+for _ in range(POOL_SIZE):
+    _pool.put(_open_connection())
+
+@contextmanager
+def get_conn() -> Iterator[sqlite3.Connection]:
+    """Borrows a connection from the pool and returns it when done."""
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put(conn)
+
+# --- Duplicate NIK Cache ---
+# Bounded LRU of NIKs known to exist in the database. Only positive results are
+# cached: rows are never deleted, so an entry can't go stale, whereas a cached
+# "not found" could hide a row inserted meanwhile by another worker process.
+_nik_cache: "OrderedDict[str, bool]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_contains(nik: str) -> bool:
+    with _cache_lock:
+        if nik not in _nik_cache:
+            return False
+        _nik_cache.move_to_end(nik)
+        return True
+
+def _cache_add(nik: str) -> None:
+    with _cache_lock:
+        _nik_cache[nik] = True
+        _nik_cache.move_to_end(nik)
+        if len(_nik_cache) > NIK_CACHE_MAXSIZE:
+            _nik_cache.popitem(last=False)
+
 # --- Tool 1: Check for Duplicate NIK (No changes needed here) ---
 class CheckDuplicateNikInput(BaseModel):
     """Input schema for the NIK duplication check tool."""
@@ -20,23 +70,50 @@ class CheckDuplicateNikInput(BaseModel):
 @tool("check_duplicate_nik_tool", args_schema=CheckDuplicateNikInput)
 def check_duplicate_nik_tool(nik: str) -> Dict[str, str]:
     """Checks if a given NIK already exists in the 'id_cards' table."""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM id_cards WHERE nik = ?", (nik,))
-        if cursor.fetchone():
-            logger.warning(f"Duplicate NIK found in database: {nik}")
-            return {"status": "duplicate", "nik": nik}
-        else:
-            return {"status": "not_found", "nik": nik}
-    except sqlite3.Error as e:
-        logger.error(f"Database error while checking NIK {nik}: {e}")
-        return {"status": "error", "error": str(e)}
-    finally:
-        if conn:
-            conn.close()
+    exists = _cache_contains(nik)
+    if not exists:
+        try:
+            with get_conn() as conn:
+                cursor = conn.execute("SELECT 1 FROM id_cards WHERE nik = ? LIMIT 1", (nik,))
+                exists = cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            logger.error(f"Database error while checking NIK {nik}: {e}")
+            return {"status": "error", "error": str(e)}
+        if exists:
+            _cache_add(nik)
+
+    if exists:
+        logger.warning(f"Duplicate NIK found in database: {nik}")
+        return {"status": "duplicate", "nik": nik}
+    else:
+        return {"status": "not_found", "nik": nik}
 
 # --- Tool 2: Insert ID Card Data (Corrected and Enhanced) ---
+INSERT_ID_CARD_QUERY = """
+INSERT INTO id_cards (nik, nama, tempat_lahir, tanggal_lahir, jenis_kelamin, gol_darah, alamat, rt_rw, kel_desa, kecamatan, agama, status_perkawinan, kewarganegaraan, berlaku_hingga, place_of_creation, date_of_creation)
+VALUES (:nik, :nama, :tempat_lahir, :tanggal_lahir, :jenis_kelamin, :gol_darah, :alamat, :rt_rw, :kel_desa, :kecamatan, :agama, :status_perkawinan, :kewarganegaraan, :berlaku_hingga, :place_of_creation, :date_of_creation)
+"""
+
+def _insert_many(records: List[Dict[str, Any]]) -> None:
+    """
+    Inserts already-mapped records in a single transaction (one commit for the batch).
+    Either every record is written or, if any insert fails, none are.
+    """
+    with get_conn() as conn:
+        # Connections run in autocommit mode, so the transaction is opened explicitly.
+        # IMMEDIATE takes the write lock up front instead of upgrading mid-transaction.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(INSERT_ID_CARD_QUERY, records)
+            conn.execute("COMMIT")
+        except BaseException:
+            # Never hand a connection back to the pool with a transaction still open
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    for record in records:
+        _cache_add(record['nik'])
+
 class InsertIdCardInput(BaseModel):
     """Input schema for the tool that inserts validated ID card data."""
     data: Dict[str, Any] = Field(description="A dictionary containing all the extracted and validated ID card fields from the vision model.")
@@ -104,23 +181,14 @@ def insert_id_card_tool(data: Dict[str, Any]) -> Dict[str, str]:
 
 
     # --- Proceed with Database Insertion ---
-    query = """
-    INSERT INTO id_cards (nik, nama, tempat_lahir, tanggal_lahir, jenis_kelamin, gol_darah, alamat, rt_rw, kel_desa, kecamatan, agama, status_perkawinan, kewarganegaraan, berlaku_hingga, place_of_creation, date_of_creation)
-    VALUES (:nik, :nama, :tempat_lahir, :tanggal_lahir, :jenis_kelamin, :gol_darah, :alamat, :rt_rw, :kel_desa, :kecamatan, :agama, :status_perkawinan, :kewarganegaraan, :berlaku_hingga, :place_of_creation, :date_of_creation)
-    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(query, db_record)
-        conn.commit()
+        _insert_many([db_record])
         logger.info(f"Successfully inserted new record for NIK: {db_record['nik']}")
         return {"status": "success", "message": f"Record for NIK {db_record['nik']} added successfully."}
     except sqlite3.IntegrityError:
+        _cache_add(db_record['nik'])
         logger.warning(f"Attempted to insert a duplicate NIK: {db_record['nik']}")
         return {"status": "error", "error": "This NIK already exists in the database."}
     except sqlite3.Error as e:
         logger.error(f"Database error during insertion for NIK {db_record['nik']}: {e}")
-        return {"status": "error", "error": str(e)}
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        return {"status": "error", "error": str(e)}
\ No newline at end of file
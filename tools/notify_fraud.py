@@ -1,6 +1,7 @@
 import os
 import smtplib
 import logging
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Dict, Optional, Any
@@ -16,6 +17,97 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# --- Persistent SMTP Connection ---
+# The connection (TCP + STARTTLS + login) is opened once and reused across
+# notifications, and re-opened when the server has dropped it. Every socket
+# operation is bounded by SMTP_TIMEOUT, so a hung server can't hold _smtp_lock.
+SMTP_TIMEOUT = 30  # seconds
+_smtp: Optional[smtplib.SMTP] = None
+_smtp_lock = threading.Lock()
+
+def _get_smtp(host: str, port: int, user: str, password: str) -> smtplib.SMTP:
+    global _smtp
+    if _smtp is None:
+        server = smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls()
+            server.login(user, password)
+        except Exception:
+            server.close()
+            raise
+        _smtp = server
+    return _smtp
+
+def _reset_smtp() -> None:
+    global _smtp
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except Exception:
+            _smtp.close()
+        _smtp = None
+
+def _is_stale_connection(e: Exception) -> bool:
+    """True if the error means the cached connection is no longer usable."""
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    # Servers that time out an idle session leave a 421 to be read on the next command
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code == 421
+    # A dead socket; other SMTPExceptions (also OSErrors) are real refusals
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+def _send_mail(host: str, port: int, user: str, password: str, recipient: str, message: str) -> None:
+    with _smtp_lock:
+        try:
+            try:
+                _get_smtp(host, port, user, password).sendmail(user, recipient, message)
+            except Exception as e:
+                if not _is_stale_connection(e):
+                    raise
+                # The cached connection went stale; reconnect once and retry
+                _reset_smtp()
+                _get_smtp(host, port, user, password).sendmail(user, recipient, message)
+        except Exception:
+            _reset_smtp()
+            raise
+
+# --- Email Templates ---
+# Built once at import; only the per-incident fields are substituted on send.
+_EMAIL_HTML_TEMPLATE = """
+    <!DOCTYPE html>
+    <html>
+    <body>
+        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: auto; border: 1px solid #ddd; padding: 20px;">
+            <div style="background-color: #f8d7da; color: #721c24; padding: 15px; border-radius: 5px; text-align: center;">
+                <h1 style="margin: 0;">🚨 FRAUD DETECTION ALERT</h1>
+            </div>
+            <div style="padding: 20px 0;">
+                <h2 style="color: #495057;">Incident Details</h2>
+                <p>A potential identity fraud attempt has been detected in our system. Immediate review is required.</p>
+                <div style="background-color: #f8f9fa; border: 1px solid #dee2e6; border-radius: 5px; padding: 15px;">
+                    <p><strong>Identity Number (NIK):</strong> {nik}</p>
+                    <p><strong>Reason for Flagging:</strong> <strong style="color: #c00;">{reason}</strong></p>
+                </div>
+                {details_section}
+                <div style="margin-top: 20px; background-color: #cce5ff; color: #004085; padding: 15px; border-radius: 5px;">
+                    <h2 style="margin-top:0;">Action Required</h2>
+                    <p>Please investigate this incident immediately and take appropriate action according to security protocols.</p>
+                </div>
+            </div>
+            <div style="text-align: center; color: #6c757d; font-size: 12px; margin-top: 20px;">
+                <p><em>This is an automated message from the Security Monitoring System.</em></p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+_DETAILS_SECTION_TEMPLATE = """
+                <h3 style="color: #495057; margin-top: 20px;">Submitted Information:</h3>
+                <div style="background-color: #f8f9fa; border: 1px solid #dee2e6; border-radius: 5px; padding: 15px; white-space: pre-wrap;">{details_str}</div>
+                """
+
 # --- Pydantic Schema for Tool Input ---
 class NotifyFraudInput(BaseModel):
     """Input schema for the fraud notification tool."""
@@ -53,40 +145,10 @@ def notify_fraud_tool(reason: str, nik: Optional[str] = None, details: Optional[
     # Build details string if provided
     details_str = ""
     if details:
-        for key, value in details.items():
-            details_str += f"• {key.replace('_', ' ').title()}: {value}\n"
+        details_str = "".join(f"• {key.replace('_', ' ').title()}: {value}\n" for key, value in details.items())
 
-    html_body = f"""
-    <!DOCTYPE html>
-    <html>
-    <body>
-        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: auto; border: 1px solid #ddd; padding: 20px;">
-            <div style="background-color: #f8d7da; color: #721c24; padding: 15px; border-radius: 5px; text-align: center;">
-                <h1 style="margin: 0;">🚨 FRAUD DETECTION ALERT</h1>
-            </div>
-            <div style="padding: 20px 0;">
-                <h2 style="color: #495057;">Incident Details</h2>
-                <p>A potential identity fraud attempt has been detected in our system. Immediate review is required.</p>
-                <div style="background-color: #f8f9fa; border: 1px solid #dee2e6; border-radius: 5px; padding: 15px;">
-                    <p><strong>Identity Number (NIK):</strong> {nik}</p>
-                    <p><strong>Reason for Flagging:</strong> <strong style="color: #c00;">{reason}</strong></p>
-                </div>
-                {f'''
-                <h3 style="color: #495057; margin-top: 20px;">Submitted Information:</h3>
-                <div style="background-color: #f8f9fa; border: 1px solid #dee2e6; border-radius: 5px; padding: 15px; white-space: pre-wrap;">{details_str}</div>
-                ''' if details_str else ''}
-                <div style="margin-top: 20px; background-color: #cce5ff; color: #004085; padding: 15px; border-radius: 5px;">
-                    <h2 style="margin-top:0;">Action Required</h2>
-                    <p>Please investigate this incident immediately and take appropriate action according to security protocols.</p>
-                </div>
-            </div>
-            <div style="text-align: center; color: #6c757d; font-size: 12px; margin-top: 20px;">
-                <p><em>This is an automated message from the Security Monitoring System.</em></p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+    details_section = _DETAILS_SECTION_TEMPLATE.format_map({"details_str": details_str}) if details_str else ""
+    html_body = _EMAIL_HTML_TEMPLATE.format_map({"nik": nik, "reason": reason, "details_section": details_section})
 
     message = MIMEMultipart()
     message["From"] = f"ID Check Security System <{email_user}>"
@@ -96,10 +158,7 @@ def notify_fraud_tool(reason: str, nik: Optional[str] = None, details: Optional[
 
     # --- Send the Email ---
     try:
-        with smtplib.SMTP(email_host, int(email_port)) as server:
-            server.starttls()
-            server.login(email_user, email_pass)
-            server.sendmail(email_user, recipient_email, message.as_string())
+        _send_mail(email_host, int(email_port), email_user, email_pass, recipient_email, message.as_string())
         logger.info(f"Fraud notification email for NIK {nik} sent successfully.")
         return {"status": "success", "message": f"Fraud notification for NIK {nik} sent."}
     except Exception as e:
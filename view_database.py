@@ -1,29 +1,93 @@
+import atexit
+import csv
+import shutil
 import sqlite3
-from rich.console import Console
-from rich.table import Table
+import sys
+
+# apsw is an optional, thinner SQLite binding that yields rows as plain tuples
+try:
+    import apsw
+except ImportError:
+    apsw = None
 
 # Configuration
 DB_FILE = "identity_database.db"
+FETCH_BATCH_SIZE = 256
+
+# Displayed columns in table order, so rows can be unpacked positionally.
+# Tempat and tanggal lahir are combined in SQL. Keeping the statement text fixed
+# lets sqlite3 reuse its prepared statement across calls.
+SELECT_ID_CARDS_SQL = (
+    "SELECT nik, nama, tempat_lahir || ', ' || tanggal_lahir AS ttl, jenis_kelamin, alamat, rt_rw, "
+    "kel_desa, kecamatan, agama, status_perkawinan, berlaku_hingga FROM id_cards"
+)
+
+# Errors raised by whichever SQLite binding is in use
+DB_ERRORS = (sqlite3.Error, apsw.Error) if apsw else (sqlite3.Error,)
+
+_conn = None
+
+def _get_conn():
+    """
+    Return the module's database connection, opening it on first use.
+    The connection is kept for the life of the process and closed at exit.
+    """
+    global _conn
+    if _conn is None:
+        # Connect to the database read-only; the viewer never writes
+        if apsw:
+            conn = apsw.Connection(DB_FILE, flags=apsw.SQLITE_OPEN_READONLY)
+        else:
+            conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=False, isolation_level=None)
+        # Read-path tuning. journal_mode/synchronous are left to setup_database,
+        # since a read-only connection cannot change them.
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA cache_spill=OFF")
+        atexit.register(conn.close)
+        _conn = conn
+    return _conn
 
 def view_id_cards():
     """
     Display all ID card records in a beautiful table using Rich.
+    If stdout is not a terminal, the records are written as CSV instead.
     """
     try:
-        # Connect to the database
-        conn = sqlite3.connect(DB_FILE)
-        # Enable dictionary cursor for easier column access
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
         # Query all records
-        cursor.execute("SELECT * FROM id_cards")
-        records = cursor.fetchall()
+        cursor = _get_conn().execute(SELECT_ID_CARDS_SQL)
 
-        if not records:
+        # Peek at the first row to detect an empty table without fetching everything
+        first = cursor.fetchone()
+        if first is None:
             print("No records found in the database.")
             return
 
+        # Rows after the first are fetched from the cursor in batches with sqlite3;
+        # apsw cursors are iterated directly
+        def iter_records():
+            yield first
+            if apsw:
+                yield from cursor
+                return
+            while batch := cursor.fetchmany(FETCH_BATCH_SIZE):
+                yield from batch
+
+        # When output is piped or redirected, styling is wasted; write plain CSV instead
+        if not sys.stdout.isatty():
+            writer = csv.writer(sys.stdout)
+            writer.writerow(column[0] for column in cursor.description)
+            writer.writerows(iter_records())
+            return
+
+        # Rich is only imported once a table is actually going to be rendered
+        from rich.console import Console
+        from rich.table import Table
+        from rich.style import Style
+        from rich.text import Text
+
         # Create a table
         table = Table(
             title="ID Card Records",
@@ -32,49 +96,36 @@ def view_id_cards():
             border_style="blue"
         )
 
-        # Add columns based on the schema
-        table.add_column("NIK", style="cyan")
-        table.add_column("Nama", style="green")
-        table.add_column("TTL", style="yellow")
-        table.add_column("Gender", style="cyan")
-        table.add_column("Alamat", style="green", max_width=30)
-        table.add_column("RT/RW", style="yellow")
-        table.add_column("Kelurahan", style="cyan")
-        table.add_column("Kecamatan", style="green")
-        table.add_column("Agama", style="yellow")
-        table.add_column("Status", style="cyan")
-        table.add_column("Berlaku Hingga", style="green")
-
-        # Add rows
-        for record in records:
-            # Combine tempat and tanggal lahir
-            ttl = f"{record['tempat_lahir']}, {record['tanggal_lahir']}"
-            
-            table.add_row(
-                str(record['nik']),
-                record['nama'],
-                ttl,
-                record['jenis_kelamin'],
-                record['alamat'],
-                record['rt_rw'],
-                record['kel_desa'],
-                record['kecamatan'],
-                record['agama'],
-                record['status_perkawinan'],
-                record['berlaku_hingga']
-            )
+        # Add columns based on the schema, with styles parsed once up front
+        cyan, green, yellow = Style.parse("cyan"), Style.parse("green"), Style.parse("yellow")
+        table.add_column("NIK", style=cyan)
+        table.add_column("Nama", style=green)
+        table.add_column("TTL", style=yellow)
+        table.add_column("Gender", style=cyan)
+        table.add_column("Alamat", style=green, max_width=30)
+        table.add_column("RT/RW", style=yellow)
+        table.add_column("Kelurahan", style=cyan)
+        table.add_column("Kecamatan", style=green)
+        table.add_column("Agama", style=yellow)
+        table.add_column("Status", style=cyan)
+        table.add_column("Berlaku Hingga", style=green)
+
+        # Add rows as ready-made Text cells, so Rich doesn't parse markup or
+        # resolve styles for every cell
+        col_styles = [cyan, green, yellow, cyan, green, yellow, cyan, green, yellow, cyan, green]
+        for record in iter_records():
+            table.add_row(*[
+                Text(str(value) if value is not None else "", style=style)
+                for value, style in zip(record, col_styles)
+            ])
 
         # Create and print to console
-        console = Console()
-        console.print("\n")  # Add some spacing
-        console.print(table)
-        console.print("\n")  # Add some spacing
+        console = Console(force_terminal=True, width=shutil.get_terminal_size().columns, safe_box=False)
+        # A single print call, with the spacing lines around the table
+        console.print("\n", table, "\n", sep="\n")
 
-    except sqlite3.Error as e:
+    except DB_ERRORS as e:
         print(f"Database error occurred: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 if __name__ == "__main__":
     view_id_cards()